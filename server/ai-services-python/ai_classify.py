@@ -1,14 +1,27 @@
 import os
 import logging
 import asyncio
-import httpx
-from typing import List, Dict, Any
-from fastapi import FastAPI
+import hashlib
+import json
+import time
+import aiohttp
+import numpy as np
+import onnxruntime as ort
+import orjson
+from cachetools import TTLCache
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, AsyncIterator
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
 from dotenv import load_dotenv
+from tokenizers import Tokenizer
 from google import genai
+from google.genai import types
+from keyword_matcher import KEYWORD_CONFIDENCE, build_keyword_pattern, match_category_keyword
 
 # ==========================================
 # Setup
@@ -24,6 +37,13 @@ HF_TOKEN = os.getenv("HF_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "services")
+NLI_MODEL_DIR = os.getenv("NLI_MODEL_DIR")
+# Every worker loads its own copy of the local ONNX models (the INT8
+# bart-large-mnli alone is several hundred MB), so memory grows with WORKERS.
+# With the local model, default to a single worker and let ONNX Runtime use
+# all cores for intra-op threads; override via WORKERS if memory allows.
+WORKERS = int(os.getenv("WORKERS", 1 if NLI_MODEL_DIR else (os.cpu_count() or 1)))
+EMBED_MODEL_DIR = os.getenv("EMBED_MODEL_DIR")
 
 if not HF_TOKEN:
     raise EnvironmentError("Missing HF_TOKEN in .env file.")
@@ -36,6 +56,7 @@ if not GEMINI_API_KEY:
 # ==========================================
 # Modern Client Initialization
 client = genai.Client(api_key=GEMINI_API_KEY)
+GEMINI_MODEL = "gemini-flash-latest"
 
 # ==========================================
 # HuggingFace Classification Setup
@@ -47,17 +68,60 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+# `connect` covers waiting for a pooled connection plus the handshake.
+CLASSIFY_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=5, sock_connect=5, sock_read=20)
+HYPOTHESIS_TEMPLATE = "The user needs {}."
+
 # ==========================================
 # Database
 # ==========================================
-db_client = MongoClient(MONGO_URI)
-db = db_client[MONGO_DB_NAME]
 LABEL_COL = "categories"
 
+# ==========================================
+# ONNX Runtime
+# ==========================================
+def ort_session(model_path: str) -> ort.InferenceSession:
+    # Split the cores between uvicorn workers so they don't oversubscribe the CPU.
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // WORKERS)
+    return ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
 # ==========================================
 # FastAPI
 # ==========================================
-app = FastAPI(title="AI Service Matcher")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled session per process so calls to the HF router reuse
+    # keep-alive connections instead of a fresh TCP+TLS handshake each time.
+    app.state.http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=128, limit_per_host=64, ttl_dns_cache=300, keepalive_timeout=60)
+    )
+    app.state.local_nli = await asyncio.to_thread(load_local_nli)
+
+    # The HF batcher is only needed when classification isn't done locally.
+    app.state.batcher = None
+    if app.state.local_nli is None:
+        app.state.batcher = ClassificationBatcher(app.state.http_session)
+        app.state.batcher.start()
+    app.state.embedder = await asyncio.to_thread(load_embedder)
+    app.state.semantic_cache = SemanticCache(app.state.embedder.dim) if app.state.embedder else None
+
+    app.state.db_client = AsyncMongoClient(MONGO_URI, minPoolSize=5, maxPoolSize=20, serverSelectionTimeoutMS=3000)
+    app.state.db = app.state.db_client[MONGO_DB_NAME]
+    await warm_up_db(app.state.db)
+
+    await get_dynamic_labels(app.state.db)
+    labels_task = asyncio.create_task(refresh_labels_periodically(app.state.db))
+    try:
+        yield
+    finally:
+        labels_task.cancel()
+        if app.state.batcher:
+            await app.state.batcher.stop()
+        await app.state.http_session.close()
+        await app.state.db_client.close()
+
+app = FastAPI(title="AI Service Matcher", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -77,28 +141,48 @@ class DescriptionRequest(BaseModel):
 # ==========================================
 # Dynamic Labels Loader
 # ==========================================
-async def get_dynamic_labels() -> List[Dict[str, Any]]:
-    fallback = [
-        {"hypothesis_text": "Plumbing repair service", "display_name": "Plumbing Services", "slug": "plumbing"},
-        {"hypothesis_text": "Electrical installation or repair service", "display_name": "Electrical & Lighting", "slug": "electrical"},
-        {"hypothesis_text": "Home cleaning service", "display_name": "Home Cleaning Services", "slug": "cleaning"},
-        {"hypothesis_text": "Air conditioner or heating repair service", "display_name": "AC & Heating Repair", "slug": "hvac"},
-        {"hypothesis_text": "Furniture repair or carpentry service", "display_name": "Carpentry & Woodwork", "slug": "carpentry"},
-        {"hypothesis_text": "Wall painting or home painting service", "display_name": "Painting Services", "slug": "painting"},
-    ]
+FALLBACK_LABELS = [
+    {"hypothesis_text": "Plumbing repair service", "display_name": "Plumbing Services", "slug": "plumbing"},
+    {"hypothesis_text": "Electrical installation or repair service", "display_name": "Electrical & Lighting", "slug": "electrical"},
+    {"hypothesis_text": "Home cleaning service", "display_name": "Home Cleaning Services", "slug": "cleaning"},
+    {"hypothesis_text": "Air conditioner or heating repair service", "display_name": "AC & Heating Repair", "slug": "hvac"},
+    {"hypothesis_text": "Furniture repair or carpentry service", "display_name": "Carpentry & Woodwork", "slug": "carpentry"},
+    {"hypothesis_text": "Wall painting or home painting service", "display_name": "Painting Services", "slug": "painting"},
+]
+
+# Categories change rarely, so the formatted labels are kept in memory and
+# refreshed in the background instead of hitting Mongo on every request.
+LABELS_TTL = 60.0
+LABELS_REFRESH_INTERVAL = 50.0
+_labels_cache: Dict[str, Any] = {"data": None, "expires": 0.0}
+_labels_lock = asyncio.Lock()
 
+def compute_labels_hash(labels: List[str]) -> bytes:
+    return hashlib.blake2b("\n".join(labels).encode(), digest_size=16).digest()
+
+def build_label_set(labels: List[Dict[str, Any]]) -> Dict[str, Any]:
+    hypothesis_list = [item["hypothesis_text"] for item in labels]
+    keyword_pattern, keyword_slugs = build_keyword_pattern(labels)
+    return {
+        "labels": labels,
+        "hypothesis_list": hypothesis_list,
+        "labels_hash": compute_labels_hash(hypothesis_list),
+        "slugs": {item["slug"] for item in labels},
+        "by_hypothesis": {item["hypothesis_text"]: item for item in labels},
+        "by_slug": {item["slug"]: item for item in labels},
+        "keyword_pattern": keyword_pattern,
+        "keyword_slugs": keyword_slugs,
+    }
+
+async def fetch_labels(db: AsyncDatabase) -> Optional[List[Dict[str, Any]]]:
     try:
-        # This is a synchronous DB call. To avoid blocking the async event loop,
-        # we run it in a separate thread.
-        def db_call():
-            return list(db[LABEL_COL].find({"isActive": {"$ne": False}}).sort("priority", -1))
-        
-        categories = await asyncio.to_thread(db_call)
+        cursor = db[LABEL_COL].find({"isActive": {"$ne": False}}).sort("priority", -1)
+        categories = await cursor.to_list(length=500)
         logging.info(f"Loaded {len(categories)} categories from DB")
 
         if not categories:
             logging.warning("No active categories found, using fallback.")
-            return fallback
+            return FALLBACK_LABELS
 
         formatted = []
         for cat in categories:
@@ -117,72 +201,470 @@ async def get_dynamic_labels() -> List[Dict[str, Any]]:
                 "slug": cat.get("slug", name.lower().replace(" ", "-"))
             })
 
-        return formatted if formatted else fallback
+        return formatted if formatted else FALLBACK_LABELS
 
     except Exception as e:
         logging.error(f"MongoDB Error: {e}")
-        return fallback
+        return None
+
+async def warm_up_db(db: AsyncDatabase):
+    # Open the pool and make the label sort index-backed before the first request.
+    try:
+        await db.command("ping")
+        await db[LABEL_COL].create_index([("priority", -1), ("isActive", 1)])
+    except Exception as e:
+        logging.warning(f"MongoDB warm-up failed, labels will use the fallback until it recovers: {e}")
+
+async def refresh_labels(db: AsyncDatabase) -> Dict[str, Any]:
+    labels = await fetch_labels(db)
+
+    if labels is None:
+        # Keep serving the last good set while Mongo is unavailable.
+        label_set = _labels_cache["data"] or build_label_set(FALLBACK_LABELS)
+    else:
+        label_set = build_label_set(labels)
+
+    _labels_cache["data"] = label_set
+    _labels_cache["expires"] = time.monotonic() + LABELS_TTL
+    return label_set
+
+async def get_dynamic_labels(db: AsyncDatabase) -> Dict[str, Any]:
+    if _labels_cache["data"] and time.monotonic() < _labels_cache["expires"]:
+        return _labels_cache["data"]
+
+    async with _labels_lock:
+        # Another request may have refreshed while we waited for the lock.
+        if _labels_cache["data"] and time.monotonic() < _labels_cache["expires"]:
+            return _labels_cache["data"]
+        return await refresh_labels(db)
+
+async def refresh_labels_periodically(db: AsyncDatabase):
+    while True:
+        await asyncio.sleep(LABELS_REFRESH_INTERVAL)
+        async with _labels_lock:
+            await refresh_labels(db)
+
+# ==========================================
+# Direct Responses (no model calls)
+# ==========================================
+# Greetings, test pings and unambiguous keywords are answered without HF.
+TRIVIAL_QUERIES = {"hi", "hey", "hello", "test", "testing", "help"}
+
+CLARIFICATION_RESPONSE = {
+    "recommended_service": "General Home Maintenance",
+    "slug": "general",
+    "confidence": 0,
+    "expert_advice": "Could you describe the issue in a sentence?",
+    "status": "needs_clarification"
+}
+
+def is_trivial_query(query: str) -> bool:
+    return len(query) < 4 or query.lower() in TRIVIAL_QUERIES
+
+# ==========================================
+# Exact-Match Caches
+# ==========================================
+# Verbatim repeats skip the upstream call entirely. Long free-form queries
+# are unlikely to repeat and would only churn the cache.
+CACHE_MAX_QUERY_LEN = 512
+_classification_cache = TTLCache(maxsize=10_000, ttl=3600)
+_advice_cache = TTLCache(maxsize=10_000, ttl=3600)
+_cache_lock = asyncio.Lock()
+
+def classification_cache_key(query: str, labels_hash: bytes) -> str:
+    return hashlib.blake2b(query.encode() + labels_hash).hexdigest()
+
+# ==========================================
+# Semantic Response Cache
+# ==========================================
+# Near-duplicate queries ("leaky tap" / "tap is leaking") reuse a previous
+# response instead of paying for the HF + Gemini round trips again. Queries are
+# embedded in-process by an ONNX MiniLM exported with export_embedding_model.py;
+# without EMBED_MODEL_DIR the semantic cache is simply off.
+EMBED_MAX_LENGTH = 128
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_TTL = 3600
+SEMANTIC_CACHE_MAX_ENTRIES = 500
+
+class LocalEmbedder:
+    """Mean-pooled, unit-length sentence embeddings from an ONNX MiniLM model."""
+
+    def __init__(self, model_dir: str):
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=EMBED_MAX_LENGTH)
+
+        self.session = ort_session(os.path.join(model_dir, "model.onnx"))
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        encoding = self.tokenizer.encode(text)
+        mask = np.array([encoding.attention_mask], dtype=np.int64)
+        feeds = {
+            "input_ids": np.array([encoding.ids], dtype=np.int64),
+            "attention_mask": mask,
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([encoding.type_ids], dtype=np.int64)
+
+        hidden = self.session.run(None, feeds)[0][0]
+        pooled = (hidden * mask[0][:, None]).sum(axis=0) / mask[0].sum()
+        norm = np.linalg.norm(pooled)
+        return (pooled / norm).astype(np.float32) if norm else None
+
+class SemanticCache:
+    """Ring buffer of (embedding, response) pairs searched with one matrix product.
+
+    Entries remember their slug so a deactivated category never serves hits.
+    The oldest entry is overwritten once the buffer is full.
+    """
+
+    def __init__(self, dim: int, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.expires = np.full(max_entries, -np.inf)
+        self.entries: List[Optional[Dict[str, Any]]] = [None] * max_entries
+        self._next = 0
+
+    def lookup(self, embedding: np.ndarray, active_slugs: set) -> Optional[Dict[str, Any]]:
+        scores = self.vectors @ embedding
+        scores[self.expires < time.monotonic()] = -1.0
+
+        candidates = np.flatnonzero(scores >= SEMANTIC_CACHE_THRESHOLD)
+        for idx in candidates[np.argsort(scores[candidates])[::-1]]:
+            entry = self.entries[idx]
+            if entry["slug"] in active_slugs:
+                logging.info(f"Semantic cache hit ({scores[idx]:.3f}) for: '{entry['query']}'")
+                return entry["response"]
+        return None
+
+    def store(self, embedding: np.ndarray, query: str, response: Dict[str, Any]):
+        idx = self._next
+        self.vectors[idx] = embedding
+        self.expires[idx] = time.monotonic() + SEMANTIC_CACHE_TTL
+        self.entries[idx] = {"query": query, "slug": response["slug"], "response": response}
+        self._next = (idx + 1) % len(self.entries)
+
+def load_embedder() -> Optional[LocalEmbedder]:
+    if not EMBED_MODEL_DIR:
+        return None
+    try:
+        embedder = LocalEmbedder(EMBED_MODEL_DIR)
+        logging.info(f"Loaded local embedding model from {EMBED_MODEL_DIR}")
+        return embedder
+    except Exception as e:
+        logging.error(f"Failed to load local embedding model, semantic cache disabled: {e}")
+        return None
+
+async def embed_query(embedder: LocalEmbedder, query: str) -> Optional[np.ndarray]:
+    try:
+        # Inference is CPU-bound; keep it off the event loop.
+        return await asyncio.to_thread(embedder.embed, query)
+    except Exception as e:
+        logging.error(f"Embedding Error: {e}")
+        return None
 
 # ==========================================
 # Classification (BART MNLI via HuggingFace)
 # ==========================================
-async def call_classification(http_client: httpx.AsyncClient, query: str, labels: List[str]):
-    logging.info(f"Classifying query: '{query}'")
+async def cached_classification(query: str, labels_hash: bytes) -> Optional[Dict[str, Any]]:
+    if len(query) > CACHE_MAX_QUERY_LEN:
+        return None
+    async with _cache_lock:
+        return _classification_cache.get(classification_cache_key(query, labels_hash))
+
+async def call_classification(
+    batcher: Optional["ClassificationBatcher"],
+    local_nli: Optional["LocalNLIClassifier"],
+    query: str,
+    labels: List[str],
+    labels_hash: bytes,
+):
+    cache_key = None
+    if len(query) <= CACHE_MAX_QUERY_LEN:
+        cache_key = classification_cache_key(query, labels_hash)
+        async with _cache_lock:
+            cached = _classification_cache.get(cache_key)
+        if cached:
+            return cached
+
+    if local_nli:
+        result = await classify_locally(local_nli, query, labels)
+    else:
+        result = await batcher.submit(query, labels, labels_hash)
+
+    # Zero confidence means the upstream call failed; let the next request retry.
+    if cache_key and result["confidence"]:
+        async with _cache_lock:
+            _classification_cache[cache_key] = result
+
+    return result
+
+def classification_result(label: str, score: float) -> Dict[str, Any]:
+    # Threshold on the raw score; rounding is only for the returned payload.
+    if score < 0.5:
+        # Keep the top guess so the caller can speculate on it during the fallback.
+        return {"label": "General", "confidence": round(score * 100, 2), "candidate": label}
+
+    return {"label": label, "confidence": round(score * 100, 2)}
+
+def parse_classification(result: Any) -> Dict[str, Any]:
+    if isinstance(result, dict) and "labels" in result:
+        return classification_result(result["labels"][0], result["scores"][0])
+
+    return {"label": "General", "confidence": 0}
+
+async def classify_batch(session: aiohttp.ClientSession, queries: List[str], labels: List[str]) -> List[Dict[str, Any]]:
+    results = await post_classification(session, queries, labels)
+    if results is not None:
+        return results
+
+    if len(queries) > 1:
+        # A bad batch shouldn't push every caller to the fallback with no
+        # candidate; retry each query with the single-string payload.
+        logging.warning(f"Batched classification failed, retrying {len(queries)} queries individually")
+        singles = await asyncio.gather(*(post_classification(session, [q], labels) for q in queries))
+        return [r[0] if r else {"label": "General", "confidence": 0} for r in singles]
+
+    return [{"label": "General", "confidence": 0}]
+
+# The router's zero-shot endpoint isn't documented to accept a list of inputs.
+# The first schema rejection of a list payload switches the process to
+# single-query requests for good.
+_batch_inputs_supported = True
+
+async def post_classification(session: aiohttp.ClientSession, queries: List[str], labels: List[str]) -> Optional[List[Dict[str, Any]]]:
+    """Sends one HF request; returns a result per query, or None on failure."""
+    logging.info(f"Classifying {len(queries)} queries: {queries}")
 
     payload = {
-        "inputs": query,
+        "inputs": queries if len(queries) > 1 else queries[0],
         "parameters": {
             "candidate_labels": labels,
-            "hypothesis_template": "The user needs {}."
+            "hypothesis_template": HYPOTHESIS_TEMPLATE
         }
     }
 
     try:
-        response = await http_client.post(CLASSIFY_URL, headers=HEADERS, json=payload, timeout=20.0)
-        response.raise_for_status()
-        result = response.json()
+        async with session.post(CLASSIFY_URL, data=orjson.dumps(payload), headers=HEADERS, timeout=CLASSIFY_TIMEOUT) as response:
+            response.raise_for_status()
+            result = orjson.loads(await response.read())
 
-        if isinstance(result, dict) and "labels" in result:
-            label = result["labels"][0]
-            score = result["scores"][0]
-            confidence = round(score * 100, 2)
+        results = result if isinstance(result, list) else [result]
+        if len(results) != len(queries):
+            logging.error(f"Classification returned {len(results)} results for {len(queries)} queries")
+            return None
 
-            if confidence < 50:
-                return {"label": "General", "confidence": confidence}
+        return [parse_classification(r) for r in results]
 
-            return {"label": label, "confidence": confidence}
-
-        return {"label": "General", "confidence": 0}
+    except aiohttp.ClientResponseError as e:
+        if e.status in (400, 422) and len(queries) > 1:
+            global _batch_inputs_supported
+            _batch_inputs_supported = False
+            logging.warning(f"Batched inputs rejected ({e.status}), sending queries one at a time from now on")
+        else:
+            logging.error(f"Classification Error: {e}")
+        return None
 
     except Exception as e:
         logging.error(f"Classification Error: {e}")
+        return None
+
+class ClassificationBatcher:
+    """Coalesces concurrent classification requests into one batched HF call.
+
+    Requests are collected for up to `max_wait` seconds or `max_batch` items,
+    then sent together. Requests with different label sets are sent separately.
+    Once the endpoint rejects a list payload every request is sent on its own.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, max_batch: int = 8, max_wait: float = 0.02):
+        self.session = session
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatches: set = set()
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Every pending caller gets an unclassified result rather than hanging.
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+        dispatches = list(self._dispatches)
+        for task in dispatches:
+            task.cancel()
+        await asyncio.gather(*dispatches, return_exceptions=True)
+        while not self._queue.empty():
+            self._resolve_unclassified([self._queue.get_nowait()])
+
+    @staticmethod
+    def _resolve_unclassified(items: List[tuple]):
+        for *_, future in items:
+            if not future.done():
+                future.set_result({"label": "General", "confidence": 0})
+
+    async def submit(self, query: str, labels: List[str], labels_hash: bytes) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, labels, labels_hash, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            max_batch = self.max_batch if _batch_inputs_supported else 1
+
+            try:
+                while len(batch) < max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                self._resolve_unclassified(batch)
+                raise
+
+            groups: Dict[bytes, List[tuple]] = {}
+            for item in batch:
+                groups.setdefault(item[2], []).append(item)
+
+            # Dispatch without awaiting so the next batch can fill while this one is in flight.
+            for group in groups.values():
+                task = asyncio.create_task(self._dispatch(group))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, group: List[tuple]):
+        queries = [query for query, *_ in group]
+        try:
+            results = await classify_batch(self.session, queries, group[0][1])
+            for (*_, future), result in zip(group, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._resolve_unclassified(group)
+
+# ==========================================
+# Classification (Local ONNX NLI)
+# ==========================================
+# An INT8-quantized MNLI model exported by export_nli_model.py. When
+# NLI_MODEL_DIR is set, every candidate label is scored in-process in one
+# batched forward pass and the HF router is not called at all.
+NLI_MAX_LENGTH = 128
+
+class LocalNLIClassifier:
+    """Zero-shot classifier running an ONNX MNLI model on CPU."""
+
+    def __init__(self, model_dir: str):
+        with open(os.path.join(model_dir, "config.json")) as f:
+            config = json.load(f)
+        self.entailment_id = next(i for name, i in config["label2id"].items() if name.lower() == "entailment")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        pad_id = config.get("pad_token_id")
+        if pad_id is None:
+            pad_id = self._pad_id_from_tokenizer_config(model_dir)
+        self.tokenizer.enable_padding(pad_id=pad_id, pad_token=self.tokenizer.id_to_token(pad_id))
+        self.tokenizer.enable_truncation(max_length=NLI_MAX_LENGTH)
+
+        self.session = ort_session(os.path.join(model_dir, "model_quantized.onnx"))
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _pad_id_from_tokenizer_config(self, model_dir: str) -> int:
+        with open(os.path.join(model_dir, "tokenizer_config.json")) as f:
+            pad_token = json.load(f)["pad_token"]
+        if isinstance(pad_token, dict):
+            pad_token = pad_token["content"]
+        pad_id = self.tokenizer.token_to_id(pad_token)
+        if pad_id is None:
+            raise ValueError(f"Pad token {pad_token!r} is not in the vocabulary")
+        return pad_id
+
+    def score(self, query: str, hypotheses: List[str]) -> List[float]:
+        """Returns a probability per hypothesis, softmaxed over the entailment logits."""
+        # All (query, hypothesis) pairs go through the model in one batch.
+        encodings = self.tokenizer.encode_batch(
+            [(query, HYPOTHESIS_TEMPLATE.format(h)) for h in hypotheses]
+        )
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        logits = self.session.run(None, feeds)[0]
+
+        entailment = logits[:, self.entailment_id]
+        exp = np.exp(entailment - entailment.max())
+        return (exp / exp.sum()).tolist()
+
+def load_local_nli() -> Optional[LocalNLIClassifier]:
+    if not NLI_MODEL_DIR:
+        return None
+    try:
+        nli = LocalNLIClassifier(NLI_MODEL_DIR)
+        logging.info(f"Loaded local NLI model from {NLI_MODEL_DIR}")
+        return nli
+    except Exception as e:
+        logging.error(f"Failed to load local NLI model, using the HF router instead: {e}")
+        return None
+
+async def classify_locally(nli: LocalNLIClassifier, query: str, hypotheses: List[str]) -> Dict[str, Any]:
+    try:
+        # Inference is CPU-bound; keep it off the event loop.
+        logging.info(f"Classifying query locally: '{query}'")
+        scores = await asyncio.to_thread(nli.score, query, hypotheses)
+        best = max(range(len(scores)), key=scores.__getitem__)
+        return classification_result(hypotheses[best], scores[best])
+    except Exception as e:
+        logging.error(f"Local classification error: {e}")
         return {"label": "General", "confidence": 0}
 
 # ==========================================
 # Classification Fallback (Gemini API)
 # ==========================================
+CLASSIFY_SYSTEM_PROMPT = """
+Analyze the following user request and classify it into ONE of the following service categories.
+Respond with ONLY the category name that is the best fit. If no category is a good fit, respond with "General Home Maintenance".
+"""
+
+# The static instructions go in the system instruction so each call only
+# carries the variable request text in `contents`.
+CLASSIFY_CONFIG = types.GenerateContentConfig(system_instruction=CLASSIFY_SYSTEM_PROMPT)
+
+CLASSIFY_PROMPT_TEMPLATE = """
+# Categories:
+{categories}
+
+# User Request:
+"{query}"
+
+# Your Answer (one category name only):
+"""
+
 async def classify_with_gemini(query: str, labels: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Uses Gemini as a fallback for more robust classification."""
     try:
         label_names = [item['display_name'] for item in labels]
         logging.info(f"Using Gemini for classification fallback. Categories: {label_names}")
 
-        prompt = f"""
-        Analyze the following user request and classify it into ONE of the following service categories.
-        Respond with ONLY the category name that is the best fit. If no category is a good fit, respond with "General Home Maintenance".
-
-        # Categories:
-        {', '.join(label_names)}
-
-        # User Request:
-        "{query}"
-
-        # Your Answer (one category name only):
-        """
+        prompt = CLASSIFY_PROMPT_TEMPLATE.format_map({
+            "categories": ", ".join(label_names),
+            "query": query,
+        })
 
         response = await client.aio.models.generate_content(
-            model="gemini-flash-latest",
+            model=GEMINI_MODEL,
             contents=prompt,
+            config=CLASSIFY_CONFIG,
         )
 
         if response and response.text:
@@ -206,65 +688,158 @@ async def classify_with_gemini(query: str, labels: List[Dict[str, Any]]) -> Dict
 # ==========================================
 # Expert Advice Generator (Gemini API)
 # ==========================================
-async def generate_expert_advice(service_name: str, user_query: str) -> str:
-    try:
-        logging.info(f"Generating expert advice using Gemini for: {service_name}")
+ADVICE_FALLBACK = "Please consult a certified professional for assistance."
+
+EXPERT_SYSTEM_PROMPT = """
+# ROLE
+You are a senior expert in the service named in the request. Speak like a friendly, helpful professional on a chat app—warm, direct, and non-robotic.
 
-        prompt = f"""
-        # ROLE
-        You are a senior {service_name} expert. Speak like a friendly, helpful professional on a chat app—warm, direct, and non-robotic.
+# TASK
+Respond to the customer's message.
 
-        # TASK
-        Respond to: {user_query}
+# CONTENT RULES
+1. START: Acknowledge the trouble with a quick, empathetic opening (e.g., "I know how annoying a leaky tap can be!").
+2. THE CAUSE: Give ONE specific, likely reason in plain English.
+3. THE CHECK: Suggest exactly ONE "eyes-only" check that requires zero tools or risk.
+4. THE VENDOR VALUE: Briefly mention one risk of DIY (e.g., "Tinkering with this without the right sensors can actually blow the fuse").
+5. BOOKING PUSH: Recommend 1-2 specific service names (e.g., 'AC Deep Clean') and a friendly nudge to book a verified vendor today for a longterm repair.
 
-        # CONTENT RULES
-        1. START: Acknowledge the trouble with a quick, empathetic opening (e.g., "I know how annoying a leaky tap can be!").
-        2. THE CAUSE: Give ONE specific, likely reason in plain English.
-        3. THE CHECK: Suggest exactly ONE "eyes-only" check that requires zero tools or risk.
-        4. THE VENDOR VALUE: Briefly mention one risk of DIY (e.g., "Tinkering with this without the right sensors can actually blow the fuse").
-        5. BOOKING PUSH: Recommend 1-2 specific service names (e.g., 'AC Deep Clean') and a friendly nudge to book a verified vendor today for a longterm repair.
+# STYLE
+- Keep it under 100 words.
+- Use "I" and "You."
+- No bulleted lists or "As an AI..."
+- No step-by-step repair guides.
+"""
 
-        # STYLE
-        - Keep it under 100 words.
-        - Use "I" and "You." 
-        - No bulleted lists or "As an AI..."
-        - No step-by-step repair guides.
+EXPERT_CONFIG = types.GenerateContentConfig(system_instruction=EXPERT_SYSTEM_PROMPT)
 
-        """
+EXPERT_PROMPT_TEMPLATE = """
+# SERVICE
+{service_name}
 
+# CUSTOMER MESSAGE
+{user_query}
+"""
+
+async def generate_expert_advice(service_name: str, user_query: str) -> str:
+    cache_key = None
+    if len(user_query) <= CACHE_MAX_QUERY_LEN:
+        cache_key = (service_name, user_query)
+        async with _cache_lock:
+            cached = _advice_cache.get(cache_key)
+        if cached:
+            return cached
+
+    advice = await _generate_expert_advice(service_name, user_query)
+
+    if cache_key and advice != ADVICE_FALLBACK:
+        async with _cache_lock:
+            _advice_cache[cache_key] = advice
+
+    return advice
+
+async def _generate_expert_advice(service_name: str, user_query: str) -> str:
+    try:
+        logging.info(f"Generating expert advice using Gemini for: {service_name}")
+
+        prompt = EXPERT_PROMPT_TEMPLATE.format_map({
+            "service_name": service_name,
+            "user_query": user_query,
+        })
 
         response = await client.aio.models.generate_content(
-            model="gemini-flash-latest",
+            model=GEMINI_MODEL,
             contents=prompt,
+            config=EXPERT_CONFIG,
         )
 
         if response and response.text:
             return response.text.strip()
 
-        return "Please consult a certified professional for assistance."
+        return ADVICE_FALLBACK
 
     except Exception as e:
         logging.error(f"Gemini Error: {e}")
-        return "Please consult a certified professional for assistance."
+        return ADVICE_FALLBACK
+
+async def stream_expert_advice(service_name: str, user_query: str, outcome: Dict[str, Any]) -> AsyncIterator[str]:
+    """Yields expert advice as Gemini produces it, sharing the advice cache.
+
+    Sets outcome["complete"] to True only when the full advice was delivered,
+    so callers never cache a stream that failed partway through.
+    """
+    outcome["complete"] = False
+    cache_key = None
+    if len(user_query) <= CACHE_MAX_QUERY_LEN:
+        cache_key = (service_name, user_query)
+        async with _cache_lock:
+            cached = _advice_cache.get(cache_key)
+        if cached:
+            outcome["complete"] = True
+            yield cached
+            return
+
+    chunks = []
+    failed = False
+    try:
+        logging.info(f"Streaming expert advice using Gemini for: {service_name}")
+
+        prompt = EXPERT_PROMPT_TEMPLATE.format_map({
+            "service_name": service_name,
+            "user_query": user_query,
+        })
+
+        async for chunk in await client.aio.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=EXPERT_CONFIG,
+        ):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+
+    except Exception as e:
+        logging.error(f"Gemini Error: {e}")
+        failed = True
+
+    if not chunks:
+        yield ADVICE_FALLBACK
+        return
+    if failed:
+        return
+
+    outcome["complete"] = True
+    if cache_key:
+        async with _cache_lock:
+            _advice_cache[cache_key] = "".join(chunks).strip()
 
 # ==========================================
 # AI Service Description Generator
 # ==========================================
+DESCRIPTION_SYSTEM_PROMPT = """
+As a marketing expert, write a compelling and professional service description for a local service provider.
+The description should be concise (2-3 sentences), highlight the key benefits for the customer, and encourage them to book the service. It should be ready to be displayed on a service booking website.
+"""
+
+DESCRIPTION_CONFIG = types.GenerateContentConfig(system_instruction=DESCRIPTION_SYSTEM_PROMPT)
+
+SERVICE_DESC_TEMPLATE = """
+Service Name: "{service_title}"
+Category: "{category_name}"
+"""
+
 async def generate_service_description(service_title: str, category_name: str) -> str:
     """Generates a compelling service description using Gemini."""
     try:
         logging.info(f"Generating service description for: '{service_title}'")
-        prompt = f"""
-        As a marketing expert, write a compelling and professional service description for a local service provider.
-
-        Service Name: "{service_title}"
-        Category: "{category_name}"
-
-        The description should be concise (2-3 sentences), highlight the key benefits for the customer, and encourage them to book the service. It should be ready to be displayed on a service booking website.
-        """
+        prompt = SERVICE_DESC_TEMPLATE.format_map({
+            "service_title": service_title,
+            "category_name": category_name,
+        })
         response = await client.aio.models.generate_content(
-            model="gemini-flash-latest",
+            model=GEMINI_MODEL,
             contents=prompt,
+            config=DESCRIPTION_CONFIG,
         )
         return response.text.strip() if response.text else "Could not generate a description. Please write one manually."
     except Exception as e:
@@ -274,38 +849,201 @@ async def generate_service_description(service_title: str, category_name: str) -
 # ==========================================
 # API Endpoint
 # ==========================================
-@app.post("/recommend")
-async def recommend_service(request: ClassificationRequest):
+def resolve_label(label_set: Dict[str, Any], hypothesis: str):
+    """Maps a classified hypothesis back to its (display_name, slug)."""
+    item = label_set["by_hypothesis"].get(hypothesis)
+    if item is None:
+        return "General Home Maintenance", "general"
+    return item.get("display_name", "General Home Maintenance"), item.get("slug", "general")
 
-    label_data = await get_dynamic_labels()
-    hypothesis_list = [item["hypothesis_text"] for item in label_data]
+async def classify_query(http_request: Request, label_set: Dict[str, Any], query: str, speculate: bool = True):
+    """Runs classification plus the Gemini fallback.
 
-    async with httpx.AsyncClient() as http_client:
-        classification_res = await call_classification(http_client, request.query, hypothesis_list)
+    Returns (display_name, slug, confidence, advice_task). advice_task is a
+    speculative advice task that already matches display_name, or None.
+    """
+    keyword_match = match_category_keyword(label_set, query)
+    if keyword_match:
+        logging.info(f"Keyword match for query: '{query}' -> {keyword_match[1]}")
+        return keyword_match[0], keyword_match[1], KEYWORD_CONFIDENCE, None
+
+    classification_res = await call_classification(
+        http_request.app.state.batcher,
+        http_request.app.state.local_nli,
+        query,
+        label_set["hypothesis_list"],
+        label_set["labels_hash"],
+    )
 
     # Add fallback to Gemini if confidence is low or classification is "General"
+    advice_task = None
+    speculative_name = None
     if classification_res["label"] == "General":
+        # Gemini usually agrees with the NLI model's low-confidence top guess, so start
+        # the advice for that guess now and hide its latency behind the fallback call.
+        candidate = classification_res.get("candidate")
+        if speculate and candidate:
+            speculative_name, _ = resolve_label(label_set, candidate)
+            advice_task = asyncio.create_task(generate_expert_advice(speculative_name, query))
+
         logging.warning("Primary classification failed or had low confidence. Attempting fallback with Gemini.")
-        classification_res = await classify_with_gemini(request.query, label_data)
+        classification_res = await classify_with_gemini(query, label_set["labels"])
 
-    display_name = "General Home Maintenance"
-    slug = "general"
+    display_name, slug = resolve_label(label_set, classification_res["label"])
 
-    for item in label_data:
-        if item["hypothesis_text"] == classification_res["label"]:
-            display_name = item.get("display_name", display_name)
-            slug = item.get("slug", slug)
-            break
+    if advice_task and speculative_name != display_name:
+        advice_task.cancel()
+        advice_task = None
 
-    expert_advice = await generate_expert_advice(display_name, request.query)
+    return display_name, slug, classification_res["confidence"], advice_task
 
-    return {
+async def response_cached(label_set: Dict[str, Any], query: str) -> bool:
+    """True when classification and advice are both in the exact caches and no
+    Gemini fallback is needed, i.e. the whole response is already cheap."""
+    if len(query) > CACHE_MAX_QUERY_LEN:
+        return False
+    keyword_match = match_category_keyword(label_set, query)
+    if keyword_match:
+        display_name = keyword_match[0]
+    else:
+        classification_res = await cached_classification(query, label_set["labels_hash"])
+        if not classification_res or classification_res["label"] == "General":
+            return False
+        display_name, _ = resolve_label(label_set, classification_res["label"])
+    async with _cache_lock:
+        return (display_name, query) in _advice_cache
+
+async def semantic_lookup(http_request: Request, label_set: Dict[str, Any], query: str):
+    """Returns (embedding, cached_response) from the semantic cache.
+
+    Runs before the keyword and exact-cache paths, which only save the
+    classification step. Skipped (None, None) when the semantic cache is off or
+    the exact caches already hold the full response.
+    """
+    embedder = http_request.app.state.embedder
+    if embedder is None or await response_cached(label_set, query):
+        return None, None
+
+    embedding = await embed_query(embedder, query)
+    if embedding is None:
+        return None, None
+    return embedding, http_request.app.state.semantic_cache.lookup(embedding, label_set["slugs"])
+
+def cache_response(http_request: Request, embedding: Optional[np.ndarray], query: str, response: Dict[str, Any]):
+    # Don't cache failed classifications or Gemini errors.
+    if embedding is not None and response["slug"] != "general" and response["expert_advice"] != ADVICE_FALLBACK:
+        http_request.app.state.semantic_cache.store(embedding, query, response)
+
+# Identical queries arriving together share one pipeline run instead of each
+# paying for HF and Gemini. Bounded so a burst of unique queries can't grow it.
+INFLIGHT_MAX = 1024
+_inflight: Dict[str, asyncio.Task] = {}
+
+@app.post("/recommend")
+async def recommend_service(request: ClassificationRequest, http_request: Request):
+
+    query = request.query.strip()
+    if is_trivial_query(query):
+        return CLARIFICATION_RESPONSE
+
+    key = query.lower()
+    task = _inflight.get(key)
+    if task is None:
+        if len(_inflight) >= INFLIGHT_MAX:
+            return await build_recommendation(http_request, query)
+        task = asyncio.create_task(build_recommendation(http_request, query))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+
+    # Shielded so one client disconnecting doesn't cancel the run for the others.
+    return await asyncio.shield(task)
+
+async def build_recommendation(http_request: Request, query: str) -> Dict[str, Any]:
+    label_set = await get_dynamic_labels(http_request.app.state.db)
+
+    embedding, cached = await semantic_lookup(http_request, label_set, query)
+    if cached:
+        return cached
+
+    display_name, slug, confidence, advice_task = await classify_query(http_request, label_set, query)
+
+    if advice_task:
+        expert_advice = await advice_task
+    else:
+        expert_advice = await generate_expert_advice(display_name, query)
+
+    response = {
         "recommended_service": display_name,
         "slug": slug,
-        "confidence": classification_res["confidence"],
+        "confidence": confidence,
         "expert_advice": expert_advice,
         "status": "matching_vendors"
     }
+    cache_response(http_request, embedding, query, response)
+
+    return response
+
+# Every stream ends with one of these so clients can tell full advice from a
+# stream that stopped early.
+STREAM_DONE = orjson.dumps({"done": True}) + b"\n"
+STREAM_ADVICE_ERROR = orjson.dumps({"advice_error": True}) + b"\n"
+
+def ndjson_replay(response: Dict[str, Any]) -> List[bytes]:
+    """Splits a complete /recommend response into the stream's event lines."""
+    header = {k: v for k, v in response.items() if k != "expert_advice"}
+    return [
+        orjson.dumps(header) + b"\n",
+        orjson.dumps({"advice_delta": response["expert_advice"]}) + b"\n",
+        STREAM_DONE,
+    ]
+
+@app.post("/recommend/stream")
+async def recommend_service_stream(request: ClassificationRequest, http_request: Request):
+    """NDJSON variant of /recommend: the classification is sent as soon as it is
+    known, followed by `advice_delta` events as Gemini generates the advice and
+    a final `done` event, or `advice_error` if the advice was cut short."""
+
+    query = request.query.strip()
+    if is_trivial_query(query):
+        return StreamingResponse(iter(ndjson_replay(CLARIFICATION_RESPONSE)), media_type="application/x-ndjson")
+
+    label_set = await get_dynamic_labels(http_request.app.state.db)
+
+    async def events():
+        embedding, cached = await semantic_lookup(http_request, label_set, query)
+        if cached:
+            for line in ndjson_replay(cached):
+                yield line
+            return
+
+        display_name, slug, confidence, _ = await classify_query(http_request, label_set, query, speculate=False)
+        yield orjson.dumps({
+            "recommended_service": display_name,
+            "slug": slug,
+            "confidence": confidence,
+            "status": "matching_vendors"
+        }) + b"\n"
+
+        chunks = []
+        outcome: Dict[str, Any] = {}
+        async for delta in stream_expert_advice(display_name, query, outcome):
+            chunks.append(delta)
+            yield orjson.dumps({"advice_delta": delta}) + b"\n"
+
+        if not outcome["complete"]:
+            yield STREAM_ADVICE_ERROR
+            return
+
+        yield STREAM_DONE
+        cache_response(http_request, embedding, query, {
+            "recommended_service": display_name,
+            "slug": slug,
+            "confidence": confidence,
+            "expert_advice": "".join(chunks).strip(),
+            "status": "matching_vendors"
+        })
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 @app.post("/generate-description")
 async def generate_description_endpoint(request: DescriptionRequest):
@@ -322,4 +1060,14 @@ def health():
 if __name__ == "__main__":
     import uvicorn
     logging.info("Starting AI Service Matcher API")
-    uvicorn.run("ai_classify:app", host="0.0.0.0", port=8001, reload=True)
+    # Each worker runs the lifespan handler itself, so sessions, DB pools and
+    # caches are per process and never shared across a fork.
+    uvicorn.run(
+        "ai_classify:app",
+        host="0.0.0.0",
+        port=8001,
+        workers=WORKERS,
+        loop="uvloop",
+        http="httptools",
+        reload=False,
+    )
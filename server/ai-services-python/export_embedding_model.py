@@ -0,0 +1,28 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def export_embedding_model():
+    """
+    Exports a sentence-embedding model to ONNX so ai_classify.py can embed
+    queries in-process for the semantic response cache.
+    Point EMBED_MODEL_DIR at the output directory to enable it.
+    """
+    # Export-only dependencies (requirements-export.txt); the API itself never imports them.
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    model_id = os.getenv("EMBED_MODEL_ID", "sentence-transformers/all-MiniLM-L6-v2")
+    output_dir = os.getenv("EMBED_MODEL_DIR", "models/embed-onnx")
+
+    print(f"Exporting '{model_id}' to ONNX in '{output_dir}'...")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+
+    print(f"Done. Set EMBED_MODEL_DIR={output_dir} to enable the semantic cache.")
+
+if __name__ == "__main__":
+    export_embedding_model()
@@ -0,0 +1,34 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def export_nli_model():
+    """
+    Exports an MNLI model to ONNX and applies dynamic INT8 quantization so
+    ai_classify.py can run zero-shot classification in-process on CPU.
+    Point NLI_MODEL_DIR at the output directory to enable it.
+    """
+    # Export-only dependencies (requirements-export.txt); the API itself never imports them.
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    model_id = os.getenv("NLI_MODEL_ID", "facebook/bart-large-mnli")
+    output_dir = os.getenv("NLI_MODEL_DIR", "models/nli-onnx")
+
+    print(f"Exporting '{model_id}' to ONNX in '{output_dir}'...")
+    model = ORTModelForSequenceClassification.from_pretrained(model_id, export=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+
+    print("Quantizing to dynamic INT8...")
+    quantizer = ORTQuantizer.from_pretrained(model)
+    qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=output_dir, quantization_config=qconfig)
+
+    print(f"Done. Set NLI_MODEL_DIR={output_dir} to use the quantized model.")
+
+if __name__ == "__main__":
+    export_nli_model()
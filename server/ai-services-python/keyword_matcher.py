@@ -0,0 +1,59 @@
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+# Curated category keywords, matched as word prefixes ("plumb" -> "plumber",
+# "plumbing"). A hit skips the classifier entirely, so only words that
+# unambiguously name a trade belong here; free-form aiLabel text does not.
+#
+# Symptoms ("leak") and materials ("electric") are deliberately absent: an AC,
+# washing machine, roof or gas line can all leak, and an electric oven is an
+# appliance job.
+STRONG_KEYWORDS = {
+    "plumb": "plumbing",
+    "electrician": "electrical",
+    "hvac": "hvac",
+    "carpent": "carpentry",
+    "painter": "painting",
+    "painting": "painting",
+}
+KEYWORD_CONFIDENCE = 95.0
+
+def build_keyword_pattern(labels: List[Dict[str, Any]]) -> Tuple[Optional[re.Pattern], List[str]]:
+    """Compiles the STRONG_KEYWORDS of the active categories into one alternation,
+    with one named group per slug. Returns (pattern, slug per group index)."""
+    active = {item["slug"] for item in labels}
+
+    words: Dict[str, List[str]] = {}
+    for prefix, slug in STRONG_KEYWORDS.items():
+        if slug in active:
+            words.setdefault(slug, []).append(re.escape(prefix) + r"\w*")
+
+    if not words:
+        return None, []
+
+    group_slugs = list(words)
+    alternatives = [
+        f"(?P<k{i}>{'|'.join(sorted(words[slug], key=len, reverse=True))})"
+        for i, slug in enumerate(group_slugs)
+    ]
+    return re.compile(r"\b(?:" + "|".join(alternatives) + ")"), group_slugs
+
+def match_category_keyword(label_set: Dict[str, Any], query: str) -> Optional[Tuple[str, str]]:
+    """Returns (display_name, slug) when every keyword in the query names the same
+    active category, otherwise None."""
+    pattern = label_set["keyword_pattern"]
+    if pattern is None:
+        return None
+
+    # A single pass over the query; bail out as soon as two categories match.
+    matched = None
+    for m in pattern.finditer(query.lower()):
+        slug = label_set["keyword_slugs"][int(m.lastgroup[1:])]
+        if matched and slug != matched:
+            return None
+        matched = slug
+
+    item = label_set["by_slug"].get(matched) if matched else None
+    if item is None:
+        return None
+    return item["display_name"], item["slug"]
@@ -0,0 +1,104 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from keyword_matcher import build_keyword_pattern, match_category_keyword
+
+# Admin-written aiLabels with plenty of single-category words ("control",
+# "bathroom", "kitchen", "deep") that must not turn into fast-path keywords.
+CATEGORIES = [
+    {"hypothesis_text": "Plumbing, pipe and kitchen tap repair service", "display_name": "Plumbing Services", "slug": "plumbing"},
+    {"hypothesis_text": "Electrical wiring and switch repair", "display_name": "Electrical & Lighting", "slug": "electrical"},
+    {"hypothesis_text": "Deep cleaning of bathroom and kitchen", "display_name": "Home Cleaning Services", "slug": "cleaning"},
+    {"hypothesis_text": "Pest control for termites and cockroaches", "display_name": "Pest Control", "slug": "pest-control"},
+    {"hypothesis_text": "Washing machine and fridge repair", "display_name": "Appliance Repair", "slug": "appliance-repair"},
+]
+
+# Default categories seeded by server/routes/admin.js.
+SEED_CATEGORIES = [
+    {"hypothesis_text": f"{name} service", "display_name": name, "slug": slug}
+    for name, slug in [
+        ("Plumbing", "plumbing"), ("Electrical", "electrical"), ("Cleaning", "cleaning"),
+        ("Painting", "painting"), ("Carpentry", "carpentry"), ("Appliance Repair", "appliance-repair"),
+        ("HVAC", "hvac"), ("Landscaping", "landscaping"), ("Moving", "moving"),
+        ("Pest Control", "pest-control"), ("Handyman", "handyman"),
+    ]
+]
+
+def label_set(labels):
+    pattern, slugs = build_keyword_pattern(labels)
+    return {
+        "keyword_pattern": pattern,
+        "keyword_slugs": slugs,
+        "by_slug": {item["slug"]: item for item in labels},
+    }
+
+class BuildKeywordPatternTest(unittest.TestCase):
+
+    def test_only_curated_keywords_of_active_slugs(self):
+        pattern, slugs = build_keyword_pattern(CATEGORIES)
+        self.assertEqual(sorted(slugs), ["electrical", "plumbing"])
+        for word in ("control", "bathroom", "kitchen", "deep", "washing"):
+            self.assertIsNone(pattern.search(word), word)
+
+    def test_no_active_keyword_categories(self):
+        pattern, slugs = build_keyword_pattern([CATEGORIES[3]])
+        self.assertIsNone(pattern)
+        self.assertEqual(slugs, [])
+
+class MatchCategoryKeywordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.labels = label_set(CATEGORIES)
+
+    def test_ailabel_words_do_not_short_circuit(self):
+        self.assertIsNone(match_category_keyword(self.labels, "control panel on washing machine broken"))
+        self.assertIsNone(match_category_keyword(self.labels, "bathroom pipe burst"))
+
+    def test_strong_keyword_matches(self):
+        self.assertEqual(
+            match_category_keyword(self.labels, "need a plumber for my kitchen tap"),
+            ("Plumbing Services", "plumbing"),
+        )
+        self.assertEqual(
+            match_category_keyword(self.labels, "Need an ELECTRICIAN today"),
+            ("Electrical & Lighting", "electrical"),
+        )
+
+    def test_keywords_must_start_a_word(self):
+        self.assertIsNone(match_category_keyword(self.labels, "the rewiring is fine, the oven isn't"))
+
+    def test_multiple_categories_fall_through(self):
+        self.assertIsNone(match_category_keyword(self.labels, "plumber and electrician needed"))
+
+    def test_inactive_category_is_ignored(self):
+        labels = label_set([c for c in CATEGORIES if c["slug"] != "plumbing"])
+        self.assertIsNone(match_category_keyword(labels, "plumber needed"))
+
+class SymptomKeywordTest(unittest.TestCase):
+    """Symptoms shared by several trades must go to the classifier."""
+
+    def setUp(self):
+        self.labels = label_set(SEED_CATEGORIES)
+
+    def test_symptoms_do_not_short_circuit(self):
+        for query in (
+            "AC is leaking water",
+            "my washing machine is leaking water",
+            "fridge leaking",
+            "roof leaking after rain",
+            "gas leak in kitchen",
+            "my kitchen tap is leaking",
+            "electric oven not heating",
+        ):
+            self.assertIsNone(match_category_keyword(self.labels, query), query)
+
+    def test_trade_names_match_seed_slugs(self):
+        self.assertEqual(match_category_keyword(self.labels, "HVAC service for my unit"), ("HVAC", "hvac"))
+        self.assertEqual(match_category_keyword(self.labels, "looking for a house painter"), ("Painting", "painting"))
+        self.assertEqual(match_category_keyword(self.labels, "carpenter to fix a door"), ("Carpentry", "carpentry"))
+
+if __name__ == "__main__":
+    unittest.main()